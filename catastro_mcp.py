@@ -5,21 +5,35 @@ Proporciona acceso a los servicios web de la Dirección General del Catastro
 
 from fastmcp import FastMCP
 import httpx
-import xml.etree.ElementTree as ET
-from typing import Optional, Dict, Any, List
+from lxml import etree as ET
+import orjson
+from typing import Optional, Dict, Any, List, Callable, Tuple
 import logging
-
-# Configurar logging
+import logging.handlers
+import asyncio
+import atexit
+import bisect
+import functools
+import operator
 import os
+import queue
+import time
+import unicodedata
+from collections import OrderedDict
+
+# Configurar logging: los handlers escriben desde un hilo aparte
+# (QueueListener), así el fichero de log no bloquea las peticiones
 log_file = os.path.join(os.path.dirname(__file__), 'catastro_mcp.log')
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_file),
-        logging.StreamHandler()
-    ]
-)
+log_queue = queue.Queue(-1)
+log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+log_handlers = [logging.FileHandler(log_file), logging.StreamHandler()]
+for log_handler in log_handlers:
+    log_handler.setFormatter(log_formatter)
+log_listener = logging.handlers.QueueListener(log_queue, *log_handlers)
+log_listener.start()
+atexit.register(log_listener.stop)
+logging.root.setLevel(logging.INFO)
+logging.root.addHandler(logging.handlers.QueueHandler(log_queue))
 logger = logging.getLogger(__name__)
 
 # Inicializar servidor MCP
@@ -30,174 +44,390 @@ BASE_URL = "http://ovc.catastro.meh.es/OVCServWeb/OVCWcfCallejero"
 CALLEJERO_URL = f"{BASE_URL}/COVCCallejero.svc/rest"
 CODIGOS_URL = f"{BASE_URL}/COVCCallejeroCodigos.svc/rest"
 
+# Endpoints concretos, construidos una sola vez
+URL_DNPLOC = f"{CALLEJERO_URL}/Consulta_DNPLOC"
+URL_DNPRC = f"{CALLEJERO_URL}/Consulta_DNPRC"
+URL_CONSULTA_NUMERO = f"{CALLEJERO_URL}/ConsultaNumero"
+URL_CONSULTA_VIA = f"{CALLEJERO_URL}/ConsultaVia"
+URL_DNPLOC_CODIGOS = f"{CODIGOS_URL}/Consulta_DNPLOC_Codigos"
+
+# Cliente HTTP compartido: reutiliza las conexiones keep-alive con el Catastro
+# entre peticiones en lugar de abrir una conexión nueva en cada consulta
+http_client = httpx.AsyncClient(
+    timeout=30.0,
+    limits=httpx.Limits(max_keepalive_connections=16, max_connections=32)
+)
+
+# Caché en memoria de respuestas ya parseadas. Los datos del Catastro cambian
+# muy poco y los reintentos (del usuario o del LLM) repiten la misma consulta.
+CACHE_TTL_SEGUNDOS = 3600
+CACHE_MAX_ENTRADAS = 1024
+_cache_respuestas: "OrderedDict[Tuple[Any, ...], Tuple[float, Any]]" = OrderedDict()
+
+# Namespace por defecto de las respuestas del Catastro. Se conserva al parsear
+# y las rutas XPath lo incluyen con el prefijo "c:".
+CATASTRO_NS = "http://www.catastro.meh.es/"
+
+# Opciones del parser XML (libxml2). Sin entidades externas ni acceso a red.
+XML_PARSER_OPCIONES = {
+    "remove_blank_text": True,
+    "remove_comments": True,
+    "remove_pis": True,
+    "ns_clean": True,
+    "resolve_entities": False,
+    "no_network": True
+}
+
+
+def compilar_xpath(ruta: str) -> ET.XPath:
+    """Compila una ruta relativa añadiendo el prefijo del namespace del Catastro"""
+    pasos = [paso if paso in ("", ".") else f"c:{paso}" for paso in ruta.split("/")]
+    return ET.XPath("/".join(pasos), namespaces={"c": CATASTRO_NS})
+
+
+# Todas las rutas que consultan los parsers, compiladas una sola vez al importar
+_XP = {ruta: compilar_xpath(ruta) for ruta in (
+    "lerr/err", "cod", "des", "idbi/rc", "idbi/cn", "dt", "locs/lous/lourb/dir",
+    "locs/lous/lourb/loint", "ldt", "debi", "lcons", "cons", "dfcons/stl",
+    "dvcons/dtip", "dt/lourb/loint", "lspr", "spr", "dspr", "rc", "num/pnp", "pc/pc1",
+    "pc/pc2", ".//prov", ".//muni", ".//calle", "dir/tv", "dir/nv", "dir/cv", ".//nump",
+    "bico", "bi", "lrcdnp"
+)}
+
+
+def buscar_elemento(elem: ET._Element, ruta: str) -> Optional[ET._Element]:
+    """Devuelve el primer elemento de `ruta` bajo `elem`, o None"""
+    encontrados = _XP[ruta](elem)
+    return encontrados[0] if encontrados else None
 
-def buscar_numero_cercano(numero_buscado: int, numeros_disponibles: List[int]) -> Optional[int]:
+
+def textos_hijos(elem: Optional[ET._Element]) -> Dict[str, Optional[str]]:
+    """
+    Devuelve el texto de los hijos directos de `elem` indexado por etiqueta
+    (sin namespace), recorriendo los hijos una sola vez. Con None devuelve {}.
+    """
+    if elem is None:
+        return {}
+    return {ET.QName(hijo).localname: hijo.text for hijo in elem}
+
+
+def localizacion_interna(campos_loint: Dict[str, Optional[str]]) -> Dict[str, Optional[str]]:
+    """Construye bloque/escalera/planta/puerta a partir de los hijos de <loint>"""
+    return {clave: campos_loint.get(etiqueta) for clave, etiqueta in (
+        ("bloque", "bq"), ("escalera", "es"), ("planta", "pt"), ("puerta", "pu")
+    )}
+
+
+def reparar_texto(texto: str) -> str:
     """
-    Encuentra el número más cercano al buscado
+    Deshace el mojibake de un texto UTF-8 leído como Latin-1 ("VÃ\x8dA" ->
+    "VÍA") y lo normaliza a NFC, de modo que cada mensaje tenga una sola grafía
     """
-    if not numeros_disponibles:
+    try:
+        texto = texto.encode("latin-1").decode("utf-8")
+    except UnicodeError:
+        pass
+    return unicodedata.normalize("NFC", texto)
+
+
+def normalizar_descripcion(texto: str) -> str:
+    """
+    Pasa una descripción de error del Catastro a mayúsculas sin tildes
+    ("El número no existe" -> "EL NUMERO NO EXISTE") para compararla
+    con una sola variante de cada mensaje
+    """
+    return unicodedata.normalize("NFKD", texto.upper()).encode("ascii", "ignore").decode("ascii")
+
+
+def parse_decimal(texto: str) -> Optional[float]:
+    """Convierte un decimal del Catastro (con coma como separador) a float"""
+    try:
+        return float(texto.replace(',', '.'))
+    except ValueError:
         return None
+
+
+def _dumps(obj: Any) -> str:
+    """
+    Serializa la respuesta de una herramienta a JSON compacto (UTF-8). La
+    respuesta la consume el cliente MCP, así que no se indenta. Se devuelve
+    str y no bytes: FastMCP envuelve el resultado de la herramienta como
+    contenido de texto dentro del mensaje JSON-RPC, que se serializa de nuevo.
+    """
+    return orjson.dumps(obj).decode()
+
+
+# Respuesta constante para las consultas sin resultados, serializada una vez
+_SIN_RESULTADOS_JSON = _dumps({
+    "error": False,
+    "mensaje": "No se encontraron resultados para los parámetros proporcionados"
+})
+
+
+def respuesta_error(tipo: str, mensaje: str) -> Dict[str, Any]:
+    """Respuesta de error de una herramienta como dict, sin serializar"""
+    return {"error": True, "tipo": tipo, "mensaje": mensaje}
+
+
+def _err(tipo: str, mensaje: str) -> str:
+    """Respuesta JSON de error de una herramienta"""
+    return _dumps(respuesta_error(tipo, mensaje))
+
+
+def buscar_numero_cercano(numero_buscado: int, candidatos: List[Tuple[int, Any]], cantidad: int = 1) -> List[Any]:
+    """
+    Devuelve los datos asociados a los `cantidad` números más cercanos al
+    buscado, del más al menos cercano. `candidatos` son pares (número, datos)
+    en cualquier orden: se ordenan por número antes de la búsqueda binaria.
+    """
+    # Ordenación estable por número: ConsultaNumero suele devolverlos ya
+    # ordenados y entonces es lineal, pero no se da por supuesto
+    ordenados = sorted(candidatos, key=operator.itemgetter(0))
+    numeros = [numero for numero, _ in ordenados]
+    return [ordenados[i][1] for i in indices_cercanos(numero_buscado, numeros, cantidad)]
+
+
+def indices_cercanos(numero_buscado: int, numeros_ordenados: List[int], cantidad: int = 1) -> List[int]:
+    """
+    Devuelve los índices de los `cantidad` números más cercanos al buscado,
+    del más al menos cercano (en caso de empate, primero el menor; los
+    números repetidos, en el orden en que aparecen en la lista).
     
-    # Ordenar números
-    numeros_ordenados = sorted(numeros_disponibles)
+    La lista debe estar ordenada: se localiza la posición con búsqueda binaria
+    y se avanza hacia ambos lados, sin recorrer la lista completa.
+    """
+    derecha = bisect.bisect_left(numeros_ordenados, numero_buscado)
+    izquierda = derecha - 1
+    total = len(numeros_ordenados)
     
-    # Buscar el más cercano
-    mejor = numeros_ordenados[0]
-    diferencia_minima = abs(numero_buscado - mejor)
+    indices = []
+    while len(indices) < cantidad and (izquierda >= 0 or derecha < total):
+        if derecha >= total or (
+            izquierda >= 0
+            and numero_buscado - numeros_ordenados[izquierda] <= numeros_ordenados[derecha] - numero_buscado
+        ):
+            # Los números repetidos se devuelven en su orden original: se
+            # salta al inicio del tramo de iguales y se recorre hacia delante
+            inicio = bisect.bisect_left(numeros_ordenados, numeros_ordenados[izquierda], 0, izquierda)
+            indices.extend(range(inicio, izquierda + 1)[:cantidad - len(indices)])
+            izquierda = inicio - 1
+        else:
+            indices.append(derecha)
+            derecha += 1
     
-    for num in numeros_ordenados:
-        diferencia = abs(numero_buscado - num)
-        if diferencia < diferencia_minima:
-            diferencia_minima = diferencia
-            mejor = num
+    return indices
+
+
+def leer_cache(clave: Tuple[Any, ...]) -> Optional[Any]:
+    """Devuelve el valor en caché para `clave` si existe y no ha caducado"""
+    entrada = _cache_respuestas.get(clave)
+    if entrada is None:
+        return None
     
-    return mejor
+    caduca, valor = entrada
+    if caduca < time.monotonic():
+        del _cache_respuestas[clave]
+        return None
+    
+    _cache_respuestas.move_to_end(clave)
+    return valor
+
+
+def guardar_cache(clave: Tuple[Any, ...], valor: Any) -> None:
+    """Guarda `valor` en caché, descartando la entrada menos usada si está llena"""
+    _cache_respuestas[clave] = (time.monotonic() + CACHE_TTL_SEGUNDOS, valor)
+    _cache_respuestas.move_to_end(clave)
+    if len(_cache_respuestas) > CACHE_MAX_ENTRADAS:
+        _cache_respuestas.popitem(last=False)
+
+
+def liberar_elemento(elem: ET._Element) -> None:
+    """Libera un elemento ya procesado y sus hermanos anteriores del árbol"""
+    elem.clear()
+    while elem.getprevious() is not None:
+        del elem.getparent()[0]
+
+
+async def consultar_catastro(
+    url: str,
+    params: Dict[str, str],
+    registros: Optional[Dict[str, Callable[[ET._Element], Any]]] = None
+) -> Tuple[ET._Element, Dict[str, List[Any]]]:
+    """
+    Descarga y parsea en streaming una respuesta del Catastro.
+    
+    El XML se parsea según llegan los bloques de la red. Los elementos
+    indicados en `registros` (rcdnp, nump, calle...) se convierten con su
+    función en cuanto se cierran y se liberan del árbol, de forma que la
+    memoria no crece con el número de resultados.
+    
+    Las respuestas se guardan en caché durante CACHE_TTL_SEGUNDOS; el árbol y
+    los registros devueltos se comparten entre llamadas y no deben modificarse.
+    
+    Returns:
+        Raíz del documento y los registros parseados por etiqueta
+    """
+    registros = registros or {}
+    
+    clave = (url, tuple(sorted(params.items())), tuple(registros.items()))
+    en_cache = leer_cache(clave)
+    if en_cache is not None:
+        logger.info("Respuesta en caché para %s", url)
+        return en_cache
+    
+    parseados = {tag: [] for tag in registros}
+    
+    # Solo se generan eventos para las etiquetas de `registros`; el resto del
+    # documento lo construye libxml2 sin pasar por Python
+    etiquetas = {f"{{{CATASTRO_NS}}}{tag}": tag for tag in registros}
+    if etiquetas:
+        parser = ET.XMLPullParser(events=("end",), tag=list(etiquetas), **XML_PARSER_OPCIONES)
+    else:
+        parser = ET.XMLPullParser(events=(), **XML_PARSER_OPCIONES)
+    
+    def procesar_eventos():
+        for _, elem in parser.read_events():
+            tag = etiquetas[elem.tag]
+            parseados[tag].append(registros[tag](elem))
+            liberar_elemento(elem)
+    
+    async with http_client.stream("GET", url, params=params) as response:
+        response.raise_for_status()
+        primer_bloque = True
+        async for chunk in response.aiter_bytes():
+            if primer_bloque:
+                # Log del inicio de la respuesta XML para depuración
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Respuesta XML (primeros 1000 bytes): %r", chunk[:1000])
+                primer_bloque = False
+            parser.feed(chunk)
+            procesar_eventos()
+    
+    root = parser.close()
+    procesar_eventos()
+    
+    guardar_cache(clave, (root, parseados))
+    return root, parseados
 
 
-def parse_xml_error(root: ET.Element) -> Optional[Dict[str, Any]]:
+def cancelar_consulta(tarea: "asyncio.Task[Any]") -> None:
+    """Cancela una consulta lanzada de forma especulativa que ya no se necesita"""
+    if not tarea.done():
+        tarea.cancel()
+    elif not tarea.cancelled():
+        # Recuperar la excepción, si la hubo, para que asyncio no la reporte
+        tarea.exception()
+
+
+def parse_xml_error(root: ET._Element) -> Optional[Dict[str, Any]]:
     """Extrae información de error del XML"""
-    error = root.find(".//lerr/err")
+    error = buscar_elemento(root, "lerr/err")
     if error is not None:
-        cod = error.find("cod")
-        des = error.find("des")
+        cod = buscar_elemento(error, "cod")
+        des = buscar_elemento(error, "des")
         return {
             "error": True,
             "codigo": cod.text if cod is not None else "UNKNOWN",
-            "descripcion": des.text if des is not None else "Error desconocido"
+            "descripcion": reparar_texto(des.text) if des is not None and des.text else "Error desconocido"
         }
     return None
 
 
-def parse_inmueble_completo(bi: ET.Element) -> Dict[str, Any]:
+def parse_inmueble_completo(bi: ET._Element) -> Dict[str, Any]:
     """Parsea un inmueble completo con todos sus datos"""
     inmueble = {}
     
     # Referencia catastral
-    rc = bi.find(".//rc")
+    rc = buscar_elemento(bi, "idbi/rc")
     if rc is not None:
-        pc1 = rc.find("pc1")
-        pc2 = rc.find("pc2")
-        car = rc.find("car")
-        cc1 = rc.find("cc1")
-        cc2 = rc.find("cc2")
+        campos_rc = textos_hijos(rc)
         
         ref_completa = ""
-        if pc1 is not None and pc2 is not None:
-            ref_completa = (pc1.text or "") + (pc2.text or "")
-            if car is not None and car.text:
-                ref_completa += car.text
-            if cc1 is not None and cc1.text:
-                ref_completa += cc1.text
-            if cc2 is not None and cc2.text:
-                ref_completa += cc2.text
+        if "pc1" in campos_rc and "pc2" in campos_rc:
+            ref_completa = (campos_rc["pc1"] or "") + (campos_rc["pc2"] or "")
+            if campos_rc.get("car"):
+                ref_completa += campos_rc["car"]
+            if campos_rc.get("cc1"):
+                ref_completa += campos_rc["cc1"]
+            if campos_rc.get("cc2"):
+                ref_completa += campos_rc["cc2"]
         
         inmueble["referencia_catastral"] = ref_completa
     
     # Tipo de bien
-    cn = bi.find(".//cn")
+    cn = buscar_elemento(bi, "idbi/cn")
     if cn is not None:
         inmueble["tipo"] = cn.text
     
     # Domicilio tributario
-    dt = bi.find(".//dt")
+    dt = buscar_elemento(bi, "dt")
     if dt is not None:
-        np = dt.find(".//np")
-        nm = dt.find(".//nm")
-        nv = dt.find(".//nv")
-        tv = dt.find(".//tv")
-        pnp = dt.find(".//pnp")
+        campos_dt = textos_hijos(dt)
+        direccion = textos_hijos(buscar_elemento(dt, "locs/lous/lourb/dir"))
         
         direccion_partes = []
-        if tv is not None and tv.text:
-            direccion_partes.append(tv.text)
-        if nv is not None and nv.text:
-            direccion_partes.append(nv.text)
-        if pnp is not None and pnp.text:
-            direccion_partes.append(pnp.text)
+        if direccion.get("tv"):
+            direccion_partes.append(direccion["tv"])
+        if direccion.get("nv"):
+            direccion_partes.append(direccion["nv"])
+        if direccion.get("pnp"):
+            direccion_partes.append(direccion["pnp"])
         
         inmueble["direccion"] = " ".join(direccion_partes) if direccion_partes else None
-        inmueble["provincia"] = np.text if np is not None else None
-        inmueble["municipio"] = nm.text if nm is not None else None
+        inmueble["provincia"] = campos_dt.get("np")
+        inmueble["municipio"] = campos_dt.get("nm")
         
         # Localización interna
-        bq = dt.find(".//bq")
-        es = dt.find(".//es")
-        pt = dt.find(".//pt")
-        pu = dt.find(".//pu")
-        
-        if any(x is not None and x.text for x in [bq, es, pt, pu]):
-            inmueble["localizacion_interna"] = {
-                "bloque": bq.text if bq is not None else None,
-                "escalera": es.text if es is not None else None,
-                "planta": pt.text if pt is not None else None,
-                "puerta": pu.text if pu is not None else None
-            }
+        loint = textos_hijos(buscar_elemento(dt, "locs/lous/lourb/loint"))
+        
+        localizacion = localizacion_interna(loint)
+        if any(localizacion.values()):
+            inmueble["localizacion_interna"] = localizacion
     
     # Domicilio tributario no estructurado
-    ldt = bi.find(".//ldt")
+    ldt = buscar_elemento(bi, "ldt")
     if ldt is not None and ldt.text:
         inmueble["domicilio_completo"] = ldt.text
     
     # Datos económicos
-    debi = bi.find(".//debi")
+    debi = buscar_elemento(bi, "debi")
     if debi is not None:
-        luso = debi.find("luso")
-        sfc = debi.find("sfc")
-        cpt = debi.find("cpt")
-        ant = debi.find("ant")
-        
-        inmueble["uso"] = luso.text if luso is not None else None
+        campos_debi = textos_hijos(debi)
+        sfc = campos_debi.get("sfc")
+        cpt = campos_debi.get("cpt")
+        ant = campos_debi.get("ant")
         
-        # Convertir superficie (puede tener coma como separador decimal)
-        if sfc is not None and sfc.text:
-            try:
-                inmueble["superficie_m2"] = float(sfc.text.replace(',', '.'))
-            except ValueError:
-                inmueble["superficie_m2"] = None
+        inmueble["uso"] = campos_debi.get("luso")
         
-        # Convertir coeficiente de participación (usa coma como separador decimal)
-        if cpt is not None and cpt.text:
-            try:
-                inmueble["coef_participacion"] = float(cpt.text.replace(',', '.'))
-            except ValueError:
-                inmueble["coef_participacion"] = None
+        # Superficie y coeficiente de participación (coma como separador decimal)
+        if sfc:
+            inmueble["superficie_m2"] = parse_decimal(sfc)
+        if cpt:
+            inmueble["coef_participacion"] = parse_decimal(cpt)
         
-        inmueble["antiguedad"] = int(ant.text) if ant is not None and ant.text else None
+        inmueble["antiguedad"] = int(ant) if ant else None
     
     # Unidades constructivas
-    lcons = bi.find(".//lcons")
+    lcons = buscar_elemento(bi, "lcons")
     if lcons is not None:
         unidades = []
-        for cons in lcons.findall(".//cons"):
+        for cons in _XP["cons"](lcons):
             unidad = {}
-            lcd = cons.find(".//lcd")
-            stl = cons.find(".//stl")
-            dtip = cons.find(".//dtip")
+            campos_cons = textos_hijos(cons)
+            stl = buscar_elemento(cons, "dfcons/stl")
+            dtip = buscar_elemento(cons, "dvcons/dtip")
             
-            if lcd is not None:
-                unidad["uso"] = lcd.text
+            if "lcd" in campos_cons:
+                unidad["uso"] = campos_cons["lcd"]
             if stl is not None and stl.text:
-                try:
-                    unidad["superficie_m2"] = float(stl.text.replace(',', '.'))
-                except ValueError:
-                    unidad["superficie_m2"] = None
+                unidad["superficie_m2"] = parse_decimal(stl.text)
             if dtip is not None:
                 unidad["tipologia"] = dtip.text
             
             # Localización de la unidad
-            loint = cons.find(".//loint")
+            loint = buscar_elemento(cons, "dt/lourb/loint")
             if loint is not None:
-                bq = loint.find("bq")
-                es = loint.find("es")
-                pt = loint.find("pt")
-                pu = loint.find("pu")
-                
-                unidad["localizacion"] = {
-                    "bloque": bq.text if bq is not None else None,
-                    "escalera": es.text if es is not None else None,
-                    "planta": pt.text if pt is not None else None,
-                    "puerta": pu.text if pu is not None else None
-                }
+                unidad["localizacion"] = localizacion_interna(textos_hijos(loint))
             
             if unidad:
                 unidades.append(unidad)
@@ -206,30 +436,25 @@ def parse_inmueble_completo(bi: ET.Element) -> Dict[str, Any]:
             inmueble["unidades_constructivas"] = unidades
     
     # Subparcelas
-    lspr = bi.find(".//lspr")
+    lspr = buscar_elemento(bi, "lspr")
     if lspr is not None:
         subparcelas = []
-        for spr in lspr.findall(".//spr"):
+        for spr in _XP["spr"](lspr):
             subparcela = {}
-            cspr = spr.find("cspr")
-            ccc = spr.find(".//ccc")
-            dcc = spr.find(".//dcc")
-            ip = spr.find(".//ip")
-            ssp = spr.find(".//ssp")
+            campos_spr = textos_hijos(spr)
+            campos_dspr = textos_hijos(buscar_elemento(spr, "dspr"))
+            ssp = campos_dspr.get("ssp")
             
-            if cspr is not None:
-                subparcela["codigo"] = cspr.text
-            if ccc is not None:
-                subparcela["calificacion"] = ccc.text
-            if dcc is not None:
-                subparcela["cultivo"] = dcc.text
-            if ip is not None:
-                subparcela["intensidad_productiva"] = ip.text
-            if ssp is not None and ssp.text:
-                try:
-                    subparcela["superficie_m2"] = float(ssp.text.replace(',', '.'))
-                except ValueError:
-                    subparcela["superficie_m2"] = None
+            if "cspr" in campos_spr:
+                subparcela["codigo"] = campos_spr["cspr"]
+            if "ccc" in campos_dspr:
+                subparcela["calificacion"] = campos_dspr["ccc"]
+            if "dcc" in campos_dspr:
+                subparcela["cultivo"] = campos_dspr["dcc"]
+            if "ip" in campos_dspr:
+                subparcela["intensidad_productiva"] = campos_dspr["ip"]
+            if ssp:
+                subparcela["superficie_m2"] = parse_decimal(ssp)
             
             if subparcela:
                 subparcelas.append(subparcela)
@@ -240,120 +465,144 @@ def parse_inmueble_completo(bi: ET.Element) -> Dict[str, Any]:
     return inmueble
 
 
-def parse_inmueble_listado(rcdnp: ET.Element) -> Dict[str, Any]:
+def parse_inmueble_listado(rcdnp: ET._Element) -> Dict[str, Any]:
     """Parsea un inmueble de un listado (versión simplificada)"""
     inmueble = {}
     
     # Referencia catastral
-    rc = rcdnp.find(".//rc")
+    rc = buscar_elemento(rcdnp, "rc")
     if rc is not None:
-        pc1 = rc.find("pc1")
-        pc2 = rc.find("pc2")
-        car = rc.find("car")
+        campos_rc = textos_hijos(rc)
         
         ref_completa = ""
-        if pc1 is not None and pc2 is not None:
-            ref_completa = (pc1.text or "") + (pc2.text or "")
-            if car is not None and car.text:
-                ref_completa += car.text
+        if "pc1" in campos_rc and "pc2" in campos_rc:
+            ref_completa = (campos_rc["pc1"] or "") + (campos_rc["pc2"] or "")
+            if campos_rc.get("car"):
+                ref_completa += campos_rc["car"]
         
         inmueble["referencia_catastral"] = ref_completa
     
     # Domicilio
-    dt = rcdnp.find(".//dt")
+    dt = buscar_elemento(rcdnp, "dt")
     if dt is not None:
-        np = dt.find(".//np")
-        nm = dt.find(".//nm")
-        nv = dt.find(".//nv")
-        tv = dt.find(".//tv")
-        pnp = dt.find(".//pnp")
+        campos_dt = textos_hijos(dt)
+        direccion = textos_hijos(buscar_elemento(dt, "locs/lous/lourb/dir"))
         
         direccion_partes = []
-        if tv is not None and tv.text:
-            direccion_partes.append(tv.text)
-        if nv is not None and nv.text:
-            direccion_partes.append(nv.text)
-        if pnp is not None and pnp.text:
-            direccion_partes.append(pnp.text)
+        if direccion.get("tv"):
+            direccion_partes.append(direccion["tv"])
+        if direccion.get("nv"):
+            direccion_partes.append(direccion["nv"])
+        if direccion.get("pnp"):
+            direccion_partes.append(direccion["pnp"])
         
         inmueble["direccion"] = " ".join(direccion_partes) if direccion_partes else None
-        inmueble["provincia"] = np.text if np is not None else None
-        inmueble["municipio"] = nm.text if nm is not None else None
+        inmueble["provincia"] = campos_dt.get("np")
+        inmueble["municipio"] = campos_dt.get("nm")
         
         # Localización interna
-        bq = dt.find(".//bq")
-        es = dt.find(".//es")
-        pt = dt.find(".//pt")
-        pu = dt.find(".//pu")
-        
-        if any(x is not None and x.text for x in [bq, es, pt, pu]):
-            inmueble["localizacion_interna"] = {
-                "bloque": bq.text if bq is not None else None,
-                "escalera": es.text if es is not None else None,
-                "planta": pt.text if pt is not None else None,
-                "puerta": pu.text if pu is not None else None
-            }
+        loint = textos_hijos(buscar_elemento(dt, "locs/lous/lourb/loint"))
+        
+        localizacion = localizacion_interna(loint)
+        if any(localizacion.values()):
+            inmueble["localizacion_interna"] = localizacion
     
     return inmueble
 
 
-def parse_candidatos(root: ET.Element, tipo: str) -> List[Dict[str, Any]]:
-    """Parsea listas de candidatos (provincias, municipios, vías, números)"""
-    candidatos = []
+def parse_numero(nump: ET._Element) -> Optional[Dict[str, Any]]:
+    """Parsea un número de portal disponible con su referencia catastral"""
+    pnp = buscar_elemento(nump, "num/pnp")
+    pc1 = buscar_elemento(nump, "pc/pc1")
+    pc2 = buscar_elemento(nump, "pc/pc2")
     
-    if tipo == "provincias":
-        for prov in root.findall(".//prov"):
-            cpine = prov.find("cpine")
-            np = prov.find("np")
-            if cpine is not None and np is not None:
-                candidatos.append({
-                    "codigo_ine": cpine.text,
-                    "nombre": np.text
-                })
-    
-    elif tipo == "municipios":
-        for muni in root.findall(".//muni"):
-            nm = muni.find("nm")
-            cmc = muni.find(".//cmc")
-            cm = muni.find(".//cm")
-            if nm is not None:
-                candidato = {"nombre": nm.text}
-                if cmc is not None:
-                    candidato["codigo_catastro"] = cmc.text
-                if cm is not None:
-                    candidato["codigo_ine"] = cm.text
-                candidatos.append(candidato)
-    
-    elif tipo == "vias":
-        for calle in root.findall(".//calle"):
-            tv = calle.find(".//tv")
-            nv = calle.find(".//nv")
-            cv = calle.find(".//cv")
-            if nv is not None:
-                candidato = {
-                    "nombre": nv.text,
-                    "tipo": tv.text if tv is not None else None
-                }
-                if cv is not None:
-                    candidato["codigo"] = cv.text
-                candidatos.append(candidato)
-    
-    elif tipo == "numeros":
-        for nump in root.findall(".//nump"):
-            pnp = nump.find(".//pnp")
-            pc1 = nump.find(".//pc1")
-            pc2 = nump.find(".//pc2")
-            if pnp is not None:
-                candidato = {"numero": pnp.text}
-                if pc1 is not None and pc2 is not None:
-                    candidato["referencia_catastral"] = (pc1.text or "") + (pc2.text or "")
-                candidatos.append(candidato)
+    if pnp is not None and pc1 is not None and pc2 is not None:
+        try:
+            num_val = int(pnp.text) if pnp.text else None
+        except ValueError:
+            return None
+        if num_val:
+            return {
+                "numero": num_val,
+                "referencia": (pc1.text or "") + (pc2.text or "")
+            }
+    return None
+
+
+# Candidatos por tipo: (contenedor, campos obligatorios, campos que se
+# incluyen siempre aunque falten, campos opcionales). Cada campo es
+# (clave, etiquetas); con varias etiquetas el valor es la concatenación y
+# solo se incluye si están todas.
+_CANDIDATOS = {
+    "provincias": (".//prov", (("codigo_ine", "cpine"), ("nombre", "np")), (), ()),
+    "municipios": (".//muni", (("nombre", "nm"),), (),
+                   (("codigo_catastro", "cmc"), ("codigo_ine", "cm"))),
+    "vias": (".//calle", (("nombre", "nv"),), (("tipo", "tv"),), (("codigo", "cv"),)),
+    "numeros": (".//nump", (("numero", "pnp"),), (),
+                (("referencia_catastral", ("pc1", "pc2")),)),
+}
+
+
+# Errores que traen candidatos, en orden de comprobación: mensaje normalizado
+# -> (tipo de candidato, clave en la respuesta, sugerencia si no hay ninguno)
+_CANDIDATOS_POR_ERROR = {
+    "PROVINCIA NO EXISTE": ("provincias", "candidatos_provincias", None),
+    "MUNICIPIO NO EXISTE": ("municipios", "candidatos_municipios", None),
+    "VIA NO EXISTE": ("vias", "candidatos_vias", None),
+    "NUMERO NO EXISTE": (
+        "numeros", "candidatos_numeros",
+        # Si no hay candidatos de números, sugerir buscar sin número
+        "El número especificado no existe. Intenta buscar sin especificar el número para ver qué números hay disponibles en esa vía."
+    ),
+}
+
+# Se memoriza porque el conjunto de descripciones de error es pequeño y se
+# repite entre peticiones. No se usa compilación JIT (Numba o similar): el
+# tiempo de cada petición se va en la red y en el parseo de lxml, que ya se
+# ejecutan fuera del intérprete.
+@functools.lru_cache(maxsize=1024)
+def mensaje_de_error(descripcion: str) -> Optional[str]:
+    """
+    Devuelve la clave de _CANDIDATOS_POR_ERROR que corresponde a una
+    descripción de error, o None. El Catastro envía los mensajes en
+    mayúsculas y sin tildes ("EL NUMERO NO EXISTE"), así que se prueba primero
+    la descripción tal cual y solo si no coincide se compara normalizada.
+    """
+    for mensaje in _CANDIDATOS_POR_ERROR:
+        if mensaje in descripcion:
+            return mensaje
     
-    return candidatos
+    descripcion = normalizar_descripcion(descripcion)
+    for mensaje in _CANDIDATOS_POR_ERROR:
+        if mensaje in descripcion:
+            return mensaje
+    return None
 
 
-@mcp.tool()
-def buscar_inmueble_inteligente(
+def parse_candidatos(root: ET._Element, tipo: str) -> Optional[List[Dict[str, Any]]]:
+    """Parsea listas de candidatos (provincias, municipios, vías, números); None si no hay"""
+    contenedor, obligatorios, siempre, opcionales = _CANDIDATOS[tipo]
+    candidatos = []
+
+    for elem in _XP[contenedor](root):
+        textos = {ET.QName(hijo).localname: hijo.text for hijo in elem.iter()}
+        if not all(etiqueta in textos for _, etiqueta in obligatorios):
+            continue
+        candidato = {clave: textos[etiqueta] for clave, etiqueta in obligatorios}
+        for clave, etiqueta in siempre:
+            candidato[clave] = textos.get(etiqueta)
+        for clave, etiquetas in opcionales:
+            if isinstance(etiquetas, str):
+                if etiquetas in textos:
+                    candidato[clave] = textos[etiquetas]
+            elif all(etiqueta in textos for etiqueta in etiquetas):
+                candidato[clave] = "".join(textos[etiqueta] or "" for etiqueta in etiquetas)
+        candidatos.append(candidato)
+
+    return candidatos or None
+
+
+async def buscar_inmueble(
     provincia: str,
     municipio: str,
     nombre_via: str,
@@ -362,38 +611,22 @@ def buscar_inmueble_inteligente(
     escalera: Optional[str] = None,
     planta: Optional[str] = None,
     puerta: Optional[str] = None
-) -> str:
+) -> Dict[str, Any]:
     """
-    Búsqueda inteligente de inmuebles. Si el número exacto no existe,
-    busca automáticamente el número más cercano disponible.
-    
-    Esta es la función RECOMENDADA para buscar por dirección.
-    
-    Args:
-        provincia: Nombre de la provincia
-        municipio: Nombre del municipio
-        nombre_via: Nombre de la vía
-        numero: Número buscado
-        tipo_via: Tipo de vía (CL, AV, etc.) - opcional pero recomendado
-        escalera: Escalera (opcional)
-        planta: Planta (opcional)
-        puerta: Puerta (opcional)
-    
-    Returns:
-        JSON con los datos del inmueble o el número más cercano encontrado
+    Implementación de buscar_inmueble_inteligente; devuelve el resultado como
+    dict para poder reutilizarla en las búsquedas por lotes.
     """
-    import json
-    
     try:
         numero_buscado = int(numero)
     except ValueError:
-        return json.dumps({
+        return {
             "error": True,
             "mensaje": f"El número '{numero}' no es válido. Debe ser un número entero."
-        }, ensure_ascii=False, indent=2)
+        }
     
-    logger.info(f"Búsqueda inteligente: {tipo_via} {nombre_via} {numero}, {municipio}, {provincia}")
+    logger.info("Búsqueda inteligente: %s %s %s, %s, %s", tipo_via, nombre_via, numero, municipio, provincia)
     
+    consulta_numeros = None
     try:
         # PASO 1: Intentar búsqueda directa
         params = {
@@ -412,19 +645,26 @@ def buscar_inmueble_inteligente(
         if puerta:
             params["Puerta"] = puerta
         
-        url = f"{CALLEJERO_URL}/Consulta_DNPLOC"
-        logger.info(f"Intento 1: Búsqueda directa con número {numero_buscado}")
+        url = URL_DNPLOC
+        logger.info("Intento 1: Búsqueda directa con número %s", numero_buscado)
         
-        with httpx.Client(timeout=30.0) as client:
-            response = client.get(url, params=params)
-            response.raise_for_status()
+        # ConsultaNumero devuelve los números cercanos disponibles en la vía. Se
+        # lanza a la vez que la búsqueda directa para que, si el número no existe,
+        # los candidatos ya estén en camino; si existe, se cancela.
+        consulta_params = {
+            "Provincia": provincia,
+            "Municipio": municipio,
+            "NombreVia": nombre_via,
+            "Numero": str(numero_buscado)
+        }
+        if tipo_via:
+            consulta_params["TipoVia"] = tipo_via
         
-        xml_text = response.text
-        xml_text = xml_text.replace(' xmlns="http://www.catastro.meh.es/"', '')
-        xml_text = xml_text.replace(' xmlns:xsd="http://www.w3.org/2001/XMLSchema"', '')
-        xml_text = xml_text.replace(' xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"', '')
+        consulta_numeros = asyncio.create_task(
+            consultar_catastro(URL_CONSULTA_NUMERO, consulta_params, {"nump": parse_numero})
+        )
         
-        root = ET.fromstring(xml_text)
+        root, registros = await consultar_catastro(url, params, {"rcdnp": parse_inmueble_listado})
         error_info = parse_xml_error(root)
         
         # Si no hay error, devolver resultado
@@ -432,84 +672,47 @@ def buscar_inmueble_inteligente(
             logger.info("Búsqueda directa exitosa")
             
             # Parsear respuesta exitosa
-            bico = root.find(".//bico")
+            bico = buscar_elemento(root, "bico")
             if bico is not None:
-                bi = bico.find(".//bi")
+                bi = buscar_elemento(bico, "bi")
                 if bi is not None:
-                    return json.dumps({
+                    return {
                         "tipo_respuesta": "inmueble_completo",
                         "numero_buscado": numero_buscado,
                         "numero_encontrado": numero_buscado,
                         "coincidencia": "exacta",
                         "inmueble": parse_inmueble_completo(bi)
-                    }, ensure_ascii=False, indent=2)
+                    }
             
-            lrcdnp = root.find(".//lrcdnp")
+            lrcdnp = buscar_elemento(root, "lrcdnp")
             if lrcdnp is not None:
-                inmuebles = []
-                for rcdnp in lrcdnp.findall(".//rcdnp"):
-                    inmuebles.append(parse_inmueble_listado(rcdnp))
+                inmuebles = registros["rcdnp"]
                 
-                return json.dumps({
+                return {
                     "tipo_respuesta": "listado_inmuebles",
                     "numero_buscado": numero_buscado,
                     "numero_encontrado": numero_buscado,
                     "coincidencia": "exacta",
                     "total": len(inmuebles),
                     "inmuebles": inmuebles
-                }, ensure_ascii=False, indent=2)
+                }
         
         # PASO 2: Si falla por número no existe, usar ConsultaNumero para obtener candidatos
-        if "NUMERO NO EXISTE" in error_info.get("descripcion", "").upper() or "NÚMERO NO EXISTE" in error_info.get("descripcion", "").upper():
-            logger.info(f"Número {numero_buscado} no existe. Usando ConsultaNumero para obtener candidatos...")
+        if mensaje_de_error(error_info.get("descripcion", "")) == "NUMERO NO EXISTE":
+            logger.info("Número %s no existe. Usando ConsultaNumero para obtener candidatos...", numero_buscado)
             
-            # Usar el servicio ConsultaNumero que devuelve números cercanos automáticamente
-            consulta_params = {
-                "Provincia": provincia,
-                "Municipio": municipio,
-                "NombreVia": nombre_via,
-                "Numero": str(numero_buscado)
-            }
-            if tipo_via:
-                consulta_params["TipoVia"] = tipo_via
-            
-            consulta_url = f"{CALLEJERO_URL}/ConsultaNumero"
-            
-            with httpx.Client(timeout=30.0) as client:
-                consulta_response = client.get(consulta_url, params=consulta_params)
-                consulta_response.raise_for_status()
-            
-            consulta_xml = consulta_response.text
-            consulta_xml = consulta_xml.replace(' xmlns="http://www.catastro.meh.es/"', '')
-            consulta_xml = consulta_xml.replace(' xmlns:xsd="http://www.w3.org/2001/XMLSchema"', '')
-            consulta_xml = consulta_xml.replace(' xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"', '')
-            
-            consulta_root = ET.fromstring(consulta_xml)
+            _, consulta_registros = await consulta_numeros
             
             # Extraer números disponibles
-            numeros_disponibles = []
-            for nump in consulta_root.findall(".//nump"):
-                pnp = nump.find(".//pnp")
-                pc1 = nump.find(".//pc1")
-                pc2 = nump.find(".//pc2")
-                
-                if pnp is not None and pc1 is not None and pc2 is not None:
-                    try:
-                        num_val = int(pnp.text) if pnp.text else None
-                        if num_val:
-                            numeros_disponibles.append({
-                                "numero": num_val,
-                                "referencia": (pc1.text or "") + (pc2.text or "")
-                            })
-                    except ValueError:
-                        continue
+            numeros_disponibles = [(n["numero"], n) for n in consulta_registros["nump"] if n is not None]
             
             if numeros_disponibles:
-                # Ordenar por diferencia con el número buscado
-                numeros_disponibles.sort(key=lambda x: abs(x["numero"] - numero_buscado))
-                numero_cercano = numeros_disponibles[0]
+                # Número más cercano y los 5 más próximos por búsqueda binaria
+                cercanos = buscar_numero_cercano(numero_buscado, numeros_disponibles, 5)
+                numero_cercano = cercanos[0]
+                otros_numeros = [n["numero"] for n in cercanos]
                 
-                logger.info(f"Número más cercano encontrado: {numero_cercano['numero']}")
+                logger.info("Número más cercano encontrado: %s", numero_cercano["numero"])
                 
                 # Buscar datos completos del número más cercano
                 params_cercano = {
@@ -521,72 +724,165 @@ def buscar_inmueble_inteligente(
                 if tipo_via:
                     params_cercano["TipoVia"] = tipo_via
                 
-                with httpx.Client(timeout=30.0) as client:
-                    response_cercano = client.get(url, params=params_cercano)
-                    response_cercano.raise_for_status()
-                
-                xml_cercano = response_cercano.text
-                xml_cercano = xml_cercano.replace(' xmlns="http://www.catastro.meh.es/"', '')
-                xml_cercano = xml_cercano.replace(' xmlns:xsd="http://www.w3.org/2001/XMLSchema"', '')
-                xml_cercano = xml_cercano.replace(' xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"', '')
-                
-                root_cercano = ET.fromstring(xml_cercano)
+                root_cercano, registros_cercano = await consultar_catastro(url, params_cercano, {"rcdnp": parse_inmueble_listado})
                 
                 # Parsear resultado
-                bico = root_cercano.find(".//bico")
+                bico = buscar_elemento(root_cercano, "bico")
                 if bico is not None:
-                    bi = bico.find(".//bi")
+                    bi = buscar_elemento(bico, "bi")
                     if bi is not None:
-                        return json.dumps({
+                        return {
                             "tipo_respuesta": "inmueble_completo",
                             "numero_buscado": numero_buscado,
                             "numero_encontrado": numero_cercano["numero"],
                             "coincidencia": "cercano",
                             "diferencia": abs(numero_buscado - numero_cercano["numero"]),
                             "mensaje": f"El número {numero_buscado} no existe. Se encontró el número más cercano: {numero_cercano['numero']}",
-                            "otros_numeros_disponibles": [n["numero"] for n in numeros_disponibles[:5]],
+                            "otros_numeros_disponibles": otros_numeros,
                             "inmueble": parse_inmueble_completo(bi)
-                        }, ensure_ascii=False, indent=2)
+                        }
                 
-                lrcdnp = root_cercano.find(".//lrcdnp")
+                lrcdnp = buscar_elemento(root_cercano, "lrcdnp")
                 if lrcdnp is not None:
-                    inmuebles = []
-                    for rcdnp in lrcdnp.findall(".//rcdnp"):
-                        inmuebles.append(parse_inmueble_listado(rcdnp))
+                    inmuebles = registros_cercano["rcdnp"]
                     
-                    return json.dumps({
+                    return {
                         "tipo_respuesta": "listado_inmuebles",
                         "numero_buscado": numero_buscado,
                         "numero_encontrado": numero_cercano["numero"],
                         "coincidencia": "cercano",
                         "diferencia": abs(numero_buscado - numero_cercano["numero"]),
                         "mensaje": f"El número {numero_buscado} no existe. Se encontró el número más cercano: {numero_cercano['numero']}",
-                        "otros_numeros_disponibles": [n["numero"] for n in numeros_disponibles[:5]],
+                        "otros_numeros_disponibles": otros_numeros,
                         "total": len(inmuebles),
                         "inmuebles": inmuebles
-                    }, ensure_ascii=False, indent=2)
+                    }
             
             # Si no se encontraron números cercanos
-            return json.dumps({
+            return {
                 "error": True,
                 "mensaje": f"No se encontró el número {numero_buscado} ni números cercanos en {tipo_via or 'CL'} {nombre_via}, {municipio}",
                 "sugerencia": "Prueba con una búsqueda por referencia catastral o verifica la dirección"
-            }, ensure_ascii=False, indent=2)
+            }
         
         # Si el error no es de número, devolverlo
-        return json.dumps(error_info, ensure_ascii=False, indent=2)
+        return error_info
         
     except Exception as e:
-        logger.error(f"Error en búsqueda inteligente: {e}", exc_info=True)
-        return json.dumps({
+        logger.error("Error en búsqueda inteligente: %s", e, exc_info=True)
+        return respuesta_error("error_inesperado", str(e))
+    
+    finally:
+        if consulta_numeros is not None:
+            cancelar_consulta(consulta_numeros)
+
+
+@mcp.tool()
+async def buscar_inmueble_inteligente(
+    provincia: str,
+    municipio: str,
+    nombre_via: str,
+    numero: str,
+    tipo_via: Optional[str] = None,
+    escalera: Optional[str] = None,
+    planta: Optional[str] = None,
+    puerta: Optional[str] = None
+) -> str:
+    """
+    Búsqueda inteligente de inmuebles. Si el número exacto no existe,
+    busca automáticamente el número más cercano disponible.
+    
+    Esta es la función RECOMENDADA para buscar por dirección.
+    
+    Args:
+        provincia: Nombre de la provincia
+        municipio: Nombre del municipio
+        nombre_via: Nombre de la vía
+        numero: Número buscado
+        tipo_via: Tipo de vía (CL, AV, etc.) - opcional pero recomendado
+        escalera: Escalera (opcional)
+        planta: Planta (opcional)
+        puerta: Puerta (opcional)
+    
+    Returns:
+        JSON con los datos del inmueble o el número más cercano encontrado
+    """
+    return _dumps(await buscar_inmueble(
+        provincia, municipio, nombre_via, numero,
+        tipo_via=tipo_via, escalera=escalera, planta=planta, puerta=puerta
+    ))
+
+
+# Límites de buscar_inmuebles_lote: cada dirección puede lanzar dos consultas
+# a la vez (DNPLOC y ConsultaNumero), así que la concurrencia se mantiene por
+# debajo del tamaño del pool para no agotar el tiempo de espera de conexión.
+# El docstring de la herramienta, que lee el cliente, repite estos valores.
+LOTE_MAX_DIRECCIONES = 100
+LOTE_MAX_CONCURRENCIA = 8
+
+# Campos de cada dirección del lote (los de buscar_inmueble_inteligente)
+CAMPOS_DIRECCION_OBLIGATORIOS = ("provincia", "municipio", "nombre_via", "numero")
+CAMPOS_DIRECCION_OPCIONALES = ("tipo_via", "escalera", "planta", "puerta")
+
+
+@mcp.tool()
+async def buscar_inmuebles_lote(direcciones: List[Dict[str, str]]) -> str:
+    """
+    Búsqueda inteligente de varias direcciones a la vez. Las consultas se
+    lanzan en paralelo (hasta 8 direcciones simultáneas). Se admiten como
+    máximo 100 direcciones por llamada.
+    
+    Args:
+        direcciones: Lista de direcciones, cada una con los mismos campos que
+            buscar_inmueble_inteligente (provincia, municipio, nombre_via,
+            numero y opcionalmente tipo_via, escalera, planta, puerta)
+    
+    Returns:
+        JSON con el resultado de cada dirección, en el mismo orden
+    """
+    if len(direcciones) > LOTE_MAX_DIRECCIONES:
+        return _dumps({
             "error": True,
-            "tipo": "error_inesperado",
-            "mensaje": str(e)
-        }, ensure_ascii=False, indent=2)
+            "mensaje": f"Demasiadas direcciones ({len(direcciones)}); el máximo por lote es {LOTE_MAX_DIRECCIONES}"
+        })
+    
+    limite = asyncio.Semaphore(LOTE_MAX_CONCURRENCIA)
+    
+    async def buscar_direccion(direccion: Dict[str, str]) -> Dict[str, Any]:
+        faltan = [campo for campo in CAMPOS_DIRECCION_OBLIGATORIOS if campo not in direccion]
+        desconocidos = [
+            campo for campo in direccion
+            if campo not in CAMPOS_DIRECCION_OBLIGATORIOS and campo not in CAMPOS_DIRECCION_OPCIONALES
+        ]
+        if faltan or desconocidos:
+            problemas = []
+            if faltan:
+                problemas.append(f"faltan los campos {', '.join(faltan)}")
+            if desconocidos:
+                problemas.append(f"campos desconocidos {', '.join(desconocidos)}")
+            return {
+                "error": True,
+                "mensaje": f"Dirección no válida: {'; '.join(problemas)}"
+            }
+        
+        async with limite:
+            return await buscar_inmueble(**direccion)
+    
+    logger.info("Búsqueda por lotes de %d direcciones", len(direcciones))
+    resultados = await asyncio.gather(*(buscar_direccion(d) for d in direcciones))
+    
+    return _dumps({
+        "tipo_respuesta": "lote",
+        "total": len(resultados),
+        "resultados": [
+            {"direccion": direccion, "resultado": resultado}
+            for direccion, resultado in zip(direcciones, resultados)
+        ]
+    })
 
 
 @mcp.tool()
-def listar_numeros_via(
+async def listar_numeros_via(
     provincia: str,
     municipio: str,
     tipo_via: Optional[str] = None,
@@ -607,7 +903,7 @@ def listar_numeros_via(
     """
     try:
         # Primero buscar la vía
-        url = f"{CALLEJERO_URL}/ConsultaVia"
+        url = URL_CONSULTA_VIA
         params = {
             "Provincia": provincia,
             "Municipio": municipio
@@ -618,31 +914,21 @@ def listar_numeros_via(
         if nombre_via:
             params["NombreVia"] = nombre_via
         
-        logger.info(f"Listando vías en {url} con parámetros: {params}")
-        
-        with httpx.Client(timeout=30.0) as client:
-            response = client.get(url, params=params)
-            response.raise_for_status()
-        
-        # Limpiar namespace
-        xml_text = response.text.replace(' xmlns="http://www.catastro.meh.es/"', '')
-        xml_text = xml_text.replace(' xmlns:xsd="http://www.w3.org/2001/XMLSchema"', '')
-        xml_text = xml_text.replace(' xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"', '')
+        logger.info("Listando vías en %s con parámetros: %s", url, params)
         
-        root = ET.fromstring(xml_text)
+        root, _ = await consultar_catastro(url, params)
         
         # Verificar errores
         error_info = parse_xml_error(root)
         if error_info:
-            import json
-            return json.dumps(error_info, ensure_ascii=False, indent=2)
+            return _dumps(error_info)
         
         # Extraer información de vías
         vias = []
-        for calle in root.findall(".//calle"):
-            cv = calle.find(".//cv")
-            tv = calle.find(".//tv")
-            nv = calle.find(".//nv")
+        for calle in _XP[".//calle"](root):
+            cv = buscar_elemento(calle, "dir/cv")
+            tv = buscar_elemento(calle, "dir/tv")
+            nv = buscar_elemento(calle, "dir/nv")
             
             if cv is not None and nv is not None:
                 vias.append({
@@ -651,25 +937,23 @@ def listar_numeros_via(
                     "nombre": nv.text
                 })
         
-        import json
-        return json.dumps({
+        return _dumps({
             "tipo_respuesta": "lista_vias",
             "total": len(vias),
             "vias": vias,
             "sugerencia": "Usa el codigo_via de la vía deseada para buscar inmuebles con más precisión"
-        }, ensure_ascii=False, indent=2)
+        })
         
     except Exception as e:
-        logger.error(f"Error listando vías: {e}", exc_info=True)
-        import json
-        return json.dumps({
+        logger.error("Error listando vías: %s", e, exc_info=True)
+        return _dumps({
             "error": True,
             "mensaje": str(e)
-        }, ensure_ascii=False, indent=2)
+        })
 
 
 @mcp.tool()
-def consulta_datos_catastro(
+async def consulta_datos_catastro(
     provincia: Optional[str] = None,
     municipio: Optional[str] = None,
     tipo_via: Optional[str] = None,
@@ -720,7 +1004,7 @@ def consulta_datos_catastro(
             if municipio:
                 params["Municipio"] = municipio
             
-            url = f"{CALLEJERO_URL}/Consulta_DNPRC"
+            url = URL_DNPRC
             
         # Si se proporcionan códigos, usar servicio de códigos
         elif codigo_provincia:
@@ -741,12 +1025,15 @@ def consulta_datos_catastro(
             if puerta:
                 params["Puerta"] = puerta
             
-            url = f"{CODIGOS_URL}/Consulta_DNPLOC_Codigos"
+            url = URL_DNPLOC_CODIGOS
             
         # Si se proporcionan denominaciones
         else:
             if not provincia or not municipio:
-                return '{"error": true, "mensaje": "Debe proporcionar provincia y municipio, o usar referencia_catastral"}'
+                return _dumps({
+                    "error": True,
+                    "mensaje": "Debe proporcionar provincia y municipio, o usar referencia_catastral"
+                })
             
             params = {
                 "Provincia": provincia,
@@ -768,77 +1055,48 @@ def consulta_datos_catastro(
             if puerta:
                 params["Puerta"] = puerta
             
-            url = f"{CALLEJERO_URL}/Consulta_DNPLOC"
+            url = URL_DNPLOC
         
         # Realizar petición
-        logger.info(f"Consultando {url} con parámetros: {params}")
-        
-        with httpx.Client(timeout=30.0) as client:
-            response = client.get(url, params=params)
-            response.raise_for_status()
-        
-        # Log de la respuesta XML para depuración
-        logger.info(f"Respuesta XML (primeros 1000 caracteres): {response.text[:1000]}")
-        
-        # Eliminar namespace del XML para facilitar el parsing
-        xml_text = response.text
-        # Remover el namespace xmlns="http://www.catastro.meh.es/"
-        xml_text = xml_text.replace(' xmlns="http://www.catastro.meh.es/"', '')
-        xml_text = xml_text.replace(' xmlns:xsd="http://www.w3.org/2001/XMLSchema"', '')
-        xml_text = xml_text.replace(' xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"', '')
+        logger.info("Consultando %s con parámetros: %s", url, params)
         
-        # Parsear XML
-        root = ET.fromstring(xml_text)
+        # Parsear XML en streaming
+        root, registros = await consultar_catastro(url, params, {"rcdnp": parse_inmueble_listado})
         
         # Verificar errores
         error_info = parse_xml_error(root)
         if error_info:
             # Buscar candidatos según el tipo de error
+            mensaje = mensaje_de_error(error_info["descripcion"])
+            if mensaje is None:
+                return _dumps(error_info)
             
-            if "PROVINCIA NO EXISTE" in error_info["descripcion"].upper():
-                candidatos = parse_candidatos(root, "provincias")
-                if candidatos:
-                    error_info["candidatos_provincias"] = candidatos
-            
-            elif "MUNICIPIO NO EXISTE" in error_info["descripcion"].upper():
-                candidatos = parse_candidatos(root, "municipios")
-                if candidatos:
-                    error_info["candidatos_municipios"] = candidatos
-            
-            elif "VIA NO EXISTE" in error_info["descripcion"].upper() or "VÃA NO EXISTE" in error_info["descripcion"].upper():
-                candidatos = parse_candidatos(root, "vias")
-                if candidatos:
-                    error_info["candidatos_vias"] = candidatos
-            
-            elif "NUMERO NO EXISTE" in error_info["descripcion"].upper() or "NÃšMERO NO EXISTE" in error_info["descripcion"].upper():
-                candidatos = parse_candidatos(root, "numeros")
-                if candidatos:
-                    error_info["candidatos_numeros"] = candidatos
-                else:
-                    # Si no hay candidatos de números, sugerir buscar sin número
-                    error_info["sugerencia"] = "El número especificado no existe. Intenta buscar sin especificar el número para ver qué números hay disponibles en esa vía."
+            tipo, clave, sugerencia = _CANDIDATOS_POR_ERROR[mensaje]
+            if (candidatos := parse_candidatos(root, tipo)) is not None:
+                extra = {clave: candidatos}
+            elif sugerencia:
+                extra = {"sugerencia": sugerencia}
+            else:
+                extra = {}
             
-            import json
-            return json.dumps(error_info, ensure_ascii=False, indent=2)
+            return _dumps({**error_info, **extra})
         
         # Parsear respuesta exitosa
         resultado = {}
         
         # Verificar si es un inmueble completo (con datos económicos)
-        bico = root.find(".//bico")
+        bico = buscar_elemento(root, "bico")
         if bico is not None:
-            bi = bico.find(".//bi")
+            bi = buscar_elemento(bico, "bi")
             if bi is not None:
                 resultado["tipo_respuesta"] = "inmueble_completo"
                 resultado["inmueble"] = parse_inmueble_completo(bi)
         
         # Verificar si es un listado de inmuebles
         else:
-            lrcdnp = root.find(".//lrcdnp")
+            lrcdnp = buscar_elemento(root, "lrcdnp")
             if lrcdnp is not None:
-                inmuebles = []
-                for rcdnp in lrcdnp.findall(".//rcdnp"):
-                    inmuebles.append(parse_inmueble_listado(rcdnp))
+                inmuebles = registros["rcdnp"]
                 
                 resultado["tipo_respuesta"] = "listado_inmuebles"
                 resultado["total"] = len(inmuebles)
@@ -846,40 +1104,21 @@ def consulta_datos_catastro(
         
         # Si no hay datos
         if not resultado:
-            resultado = {
-                "error": False,
-                "mensaje": "No se encontraron resultados para los parámetros proporcionados"
-            }
+            return _SIN_RESULTADOS_JSON
         
-        import json
-        return json.dumps(resultado, ensure_ascii=False, indent=2)
+        return _dumps(resultado)
         
     except httpx.HTTPError as e:
-        logger.error(f"Error HTTP: {e}")
-        import json
-        return json.dumps({
-            "error": True,
-            "tipo": "http_error",
-            "mensaje": str(e)
-        }, ensure_ascii=False, indent=2)
+        logger.error("Error HTTP: %s", e)
+        return _err("http_error", str(e))
     
     except ET.ParseError as e:
-        logger.error(f"Error parseando XML: {e}")
-        import json
-        return json.dumps({
-            "error": True,
-            "tipo": "parse_error",
-            "mensaje": f"Error parseando respuesta XML: {str(e)}"
-        }, ensure_ascii=False, indent=2)
+        logger.error("Error parseando XML: %s", e)
+        return _err("parse_error", f"Error parseando respuesta XML: {e}")
     
     except Exception as e:
-        logger.error(f"Error inesperado: {e}", exc_info=True)
-        import json
-        return json.dumps({
-            "error": True,
-            "tipo": "error_inesperado",
-            "mensaje": str(e)
-        }, ensure_ascii=False, indent=2)
+        logger.error("Error inesperado: %s", e, exc_info=True)
+        return _err("error_inesperado", str(e))
 
 
 if __name__ == "__main__":